@@ -0,0 +1,148 @@
+# coding=utf-8
+# Size & throughput benchmark of the compression modes on realistic records.
+import random
+import time
+import zlib
+from proto_parser import *
+
+NAMES = ["骨精灵", "剑侠客", "飞燕女", "逍遥生", "巨魔王", "狐美人", "龙太子", "玄彩娥"]
+PET_NAMES = ["小可爱", "大海龟", "超级神龙", "泡泡", "护卫"]
+GOOD_NAMES = ["金创药", "九转回魂丹", "四叶花", "高级藏宝图", "月华露"]
+GOOD_DESCS = ["恢复气血", "复活并恢复气血", "烹饪材料", "挖宝用", "提升召唤兽等级"]
+
+
+def random_player(rnd):
+    return {
+        "name": rnd.choice(NAMES),
+        "id": rnd.randint(5200000, 5300000),
+        "married": rnd.random() < 0.3,
+        "friends": tuple([rnd.randint(5200000, 5300000) for _ in range(rnd.randint(0, 6))]),
+        "position": (round(rnd.uniform(0, 500), 1), 0.0, round(rnd.uniform(0, 500), 1)),
+        "pet": {
+            "name": rnd.choice(NAMES) + "的" + rnd.choice(PET_NAMES),
+            "skill": ({"id": rnd.randint(1, 20)}, {"id": rnd.randint(1, 20)})
+        }
+    }
+
+
+def random_shop(rnd):
+    def good():
+        i = rnd.randrange(len(GOOD_NAMES))
+        return {
+            "good_id": 1000 + i,
+            "detail": {
+                "category": i % 3,
+                "prices": (rnd.randint(10, 100), rnd.randint(100, 1000)),
+                "name": GOOD_NAMES[i],
+                "desc": GOOD_DESCS[i],
+                "shape": i,
+                "skills": tuple([{"skill_id": rnd.randint(1, 50), "level": rnd.randint(1, 5),
+                                  "props": (1, 2, rnd.randint(0, 9))} for _ in range(rnd.randint(0, 1))])
+            }
+        }
+
+    return {
+        "opentype": 1,
+        "goods": tuple([good() for _ in range(rnd.randint(1, 2))]),
+        "cart": tuple([{"good_id": 1000 + rnd.randint(0, 4), "valid": True, "number": rnd.randint(1, 9)}
+                       for _ in range(rnd.randint(0, 2))]),
+        "coupons": ({"id": 1, "detail": {"type": 2, "discount": 0.5, "desc": "满100减50"}, "expired": False},)
+    }
+
+
+def measure(fn, values):
+    start = time.time()
+    results = [fn(x) for x in values]
+    return results, len(values) / (time.time() - start)
+
+
+def bench(proto_file, generator, train_count=1000, test_count=2000):
+    rnd = random.Random(20201019)
+    parser = ProtoParser()
+    parser.buildDesc(proto_file)
+    parser.trainDict([generator(rnd) for _ in range(train_count)])
+    values = [generator(rnd) for _ in range(test_count)]
+
+    raw = [encode_bytes(parser.get_schema(), x) for x in values]
+
+    # plain raw deflate of the binary encoding at the dictionary's level, the baseline dumpDictComp has to beat
+    def deflate(data):
+        compressor = zlib.compressobj(zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def inflate(data):
+        return zlib.decompress(data, -zlib.MAX_WBITS)
+
+    deflated, deflate_rate = measure(deflate, raw)
+    _, inflate_rate = measure(inflate, deflated)
+    comp, comp_dump_rate = measure(parser.dumpComp, values)
+    _, comp_load_rate = measure(parser.loadComp, comp)
+    dict_comp, dict_dump_rate = measure(parser.dumpDictComp, values)
+    _, dict_load_rate = measure(parser.loadDictComp, dict_comp)
+
+    def avg_size(items):
+        return float(sum([len(x) for x in items])) / len(items)
+
+    print("%s: %d records, dictionary %d bytes" % (
+        proto_file, test_count, len(parser.get_dict_compressor().zdict)))
+    print("  %-12s %10s %12s %12s" % ("mode", "avg bytes", "dump msg/s", "load msg/s"))
+    print("  %-12s %10.1f" % ("binary", avg_size(raw)))
+    print("  %-12s %10.1f %12.0f %12.0f" % ("dumpComp", avg_size(comp), comp_dump_rate, comp_load_rate))
+    print("  %-12s %10.1f %12.0f %12.0f" % ("deflate", avg_size(deflated), deflate_rate, inflate_rate))
+    print("  %-12s %10.1f %12.0f %12.0f" % ("dumpDictComp", avg_size(dict_comp), dict_dump_rate, dict_load_rate))
+
+
+def bench_codec(proto_file, generator, count=5000, rounds=3):
+    rnd = random.Random(20201019)
+    parser = ProtoParser()
+    parser.buildDesc(proto_file)
+    schema = parser.get_schema()
+    values = [generator(rnd) for _ in range(count)]
+    hex_strs = [parser.dumps(x) for x in values]
+    raw = [encode_bytes(schema, x) for x in values]
+
+    # best of several rounds, the codec is pure python so timings are noisy
+    def best(fn, items):
+        return max([measure(fn, items)[1] for _ in range(rounds)])
+
+    print("%s codec throughput, %d records" % (proto_file, count))
+    print("  %-12s %12s %12s" % ("mode", "dump msg/s", "load msg/s"))
+    print("  %-12s %12.0f %12.0f" % ("hex", best(parser.dumps, values), best(parser.loads, hex_strs)))
+    print("  %-12s %12.0f %12.0f" % ("binary", best(lambda x: encode_bytes(schema, x), values),
+                                     best(lambda x: decode_bytes(schema, x), raw)))
+
+
+INVENTORY_PROTO = "{uint32 owner; {uint32 id; uint16 count;}[] items; {uint16 id; uint8 level; int16[3] props;}[] skills;}"
+
+
+def random_inventory(rnd, size=2000):
+    return {
+        "owner": rnd.randint(5200000, 5300000),
+        "items": tuple([{"id": rnd.randint(10000, 99999), "count": rnd.randint(1, 999)} for _ in range(size)]),
+        "skills": tuple([{"id": rnd.randint(1, 300), "level": rnd.randint(1, 5), "props": (1, -2, 3)}
+                         for _ in range(size // 10)])
+    }
+
+
+def bench_inventory(count=50, rounds=3):
+    rnd = random.Random(20201019)
+    values = [random_inventory(rnd) for _ in range(count)]
+    print("inventory throughput, %d records of %d items" % (count, len(values[0]["items"])))
+    print("  %-12s %12s %12s" % ("rows", "dump msg/s", "load msg/s"))
+    for tuple_rows in (False, True):
+        parser = ProtoParser(tuple_rows=tuple_rows)
+        parser.parse(INVENTORY_PROTO)
+        schema = parser.get_schema()
+        raw = [encode_bytes(schema, x) for x in values]
+        rows = [decode_bytes(schema, x) for x in raw]
+        dump_rate = max([measure(lambda x: encode_bytes(schema, x), rows)[1] for _ in range(rounds)])
+        load_rate = max([measure(lambda x: decode_bytes(schema, x), raw)[1] for _ in range(rounds)])
+        print("  %-12s %12.0f %12.0f" % ("tuple" if tuple_rows else "dict", dump_rate, load_rate))
+
+
+if __name__ == '__main__':
+    bench_inventory()
+    bench_codec("a1.proto", random_player)
+    bench_codec("1_8.proto", random_shop)
+    bench("a1.proto", random_player)
+    bench("1_8.proto", random_shop)
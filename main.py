@@ -1,11 +1,19 @@
 # coding=utf-8
 # Press the green button in the gutter to run the script.
 import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+from multiprocessing.pool import ThreadPool
 from proto_parser import *
+from proto_container import ContainerWriter, ContainerReader, map_block_ranges
 
 
 def print_dict(d):
-    print json.dumps(d, encoding="utf-8", ensure_ascii=False)
+    print(json.dumps(d, ensure_ascii=False))
 
 
 test_obj = {
@@ -41,28 +49,311 @@ def test1():
     wwj = "伍文杰+苏希强烔"
     byte_arr = STRING.serialize(wwj)
     reader = ByteArrayInputStream(byte_arr)
-    print STRING.deserialize(reader)
+    print(STRING.deserialize(reader))
 
 
 def test2():
     parser = ProtoParser()
     parser.buildDesc("a1.proto")
-    print parser.dumps(test_obj)
-    print parser.dumpComp(test_obj)
+    print(parser.dumps(test_obj))
+    print(parser.dumpComp(test_obj))
 
 
 def test3():
     china = "中国"
-    print len(china)
+    print(len(china))
 
 
 def case_convert():
     value = """
     {int8 i;}@#$%^&{\n  string msg;  \n  bool flag;\n  int32 n;\n  uint32 un;\n  uint16 um;\n  int16 m;\n  int8 c;\n  uint8 uc;\n  float x;\n  double y;\n  string Chinease;    \n  string empty;\n}@#$%^&{  \n  uint32[] friends;double[3]pos;\n  string[] skills; float[]angle;\n}@#$%^&{\n   string name;    \n
     """
-    print value
+    print(value)
+
+
+def test_fragment_cache_float_sign():
+    parser = ProtoParser()
+    parser.parse("{ {float x;} p; float[] v; }")
+    cache = FragmentCache()
+    positive = {"p": FrozenRecord(x=0.0), "v": (0.0, 1.0)}
+    negative = {"p": FrozenRecord(x=-0.0), "v": (-0.0, 1.0)}
+    parser.dumps(positive, cache=cache)
+    assert parser.dumps(negative, cache=cache) == parser.dumps(negative)
+    assert parser.dumps(negative, cache=cache).startswith("00000080")
+
+
+def test_fragment_cache_keeps_value_types_apart():
+    parser = ProtoParser()
+    parser.parse("{ {int32 y;} p; }")
+    cache = FragmentCache()
+    parser.dumps({"p": FrozenRecord(y=1)}, cache=cache)
+    try:
+        parser.dumps({"p": FrozenRecord(y=1.0)}, cache=cache)
+    except struct.error:
+        pass
+    else:
+        raise AssertionError("int32 field accepted a float from the cache")
+
+
+def test_frozen_record_is_immutable():
+    parser = ProtoParser()
+    parser.parse("{ {int32 y;} p; }")
+    cache = FragmentCache()
+    record = FrozenRecord(y=1)
+    parser.dumps({"p": record}, cache=cache)
+    alias = record
+    try:
+        record["y"] = 2
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("FrozenRecord accepted item assignment")
+    try:
+        alias |= {"y": 3}
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("FrozenRecord accepted |=")
+    assert dict(record) == {"y": 1}
+    assert parser.dumps({"p": record}, cache=cache) == parser.dumps({"p": {"y": 1}})
+
+
+def test_string_rejects_non_text():
+    parser = ProtoParser()
+    parser.parse("{ string s; }")
+    assert parser.loads(parser.dumps({"s": b"ok"})) == {"s": "ok"}
+    for value in (5, [104, 105]):
+        try:
+            parser.dumps({"s": value})
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("string accepted %r" % (value,))
+
+
+def test_projection():
+    parser = ProtoParser()
+    parser.buildDesc("1_8.proto")
+    shop = {
+        "opentype": 1,
+        "goods": ({"good_id": 7, "detail": {"category": 1, "prices": (1, 2), "name": "金创药", "desc": "恢复气血",
+                                            "shape": 3, "skills": ({"skill_id": 4, "level": 5, "props": (6, 7, 8)},)}},),
+        "cart": ({"good_id": 7, "valid": True, "number": 2},),
+        "coupons": ({"id": 1, "detail": {"type": 2, "discount": 0.5, "desc": "满100减50"}, "expired": True},)
+    }
+    h = parser.dumps(shop)
+    assert parser.loads(h, fields=["coupons.expired"]) == {"coupons": ({"expired": True},)}
+    assert parser.loads(h, fields=["opentype", "goods.detail.desc"]) == {
+        "opentype": 1, "goods": ({"detail": {"desc": "恢复气血"}},)}
+
+
+def test_projection_tuple_rows():
+    proto = "{uint32 owner; {uint32 id; {uint8 a; uint8 b;} pos; uint16 count;}[] items; string note;}"
+    value = {"owner": 9, "items": ({"id": 1, "pos": {"a": 2, "b": 3}, "count": 4},
+                                   {"id": 5, "pos": {"a": 6, "b": 7}, "count": 8}), "note": "x"}
+    parser = ProtoParser(tuple_rows=True)
+    parser.parse(proto)
+    h = parser.dumps(value)
+    assert parser.loads(h)["items"] == ((1, 2, 3, 4), (5, 6, 7, 8))
+    assert parser.loads(h, fields=["items.count", "items.id"]) == {"items": ((1, 4), (5, 8))}
+    assert parser.loads(h, fields=["items.pos", "note"]) == {"items": ((2, 3), (6, 7)), "note": "x"}
+    assert parser.loads(h, fields=["items.pos.b"]) == {"items": ((3,), (7,))}
+
+
+def test_dict_per_message():
+    proto_file = os.path.join(tempfile.mkdtemp(), "pair.proto")
+    with open(proto_file, "w") as f:
+        f.write("{ string name; uint32 id; } Player;\n{ uint16 good_id; string desc; } Good;\n")
+    players = [{"name": "剑侠客%d" % i, "id": 5200000 + i} for i in range(50)]
+    goods = [{"good_id": 1000 + i, "desc": "恢复气血%d" % i} for i in range(50)]
+    parser = ProtoParser()
+    parser.buildDesc(proto_file)
+    parser.trainDict(players, "Player")
+    parser.trainDict(goods, "Good")
+    assert parser.get_dict_compressor("Player").zdict != parser.get_dict_compressor("Good").zdict
+    parser.saveDict(message="Player")
+    parser.saveDict(message="Good")
+    assert os.path.exists(proto_file + ".Player.zdict") and os.path.exists(proto_file + ".Good.zdict")
+    other = ProtoParser()
+    other.buildDesc(proto_file)
+    assert other.loadDictComp(parser.dumpDictComp(players[0], "Player"), "Player") == players[0]
+    assert other.loadDictComp(parser.dumpDictComp(goods[0], "Good"), "Good") == goods[0]
+    packed = parser.dumpDictComp(players[0], "Player")
+    for broken in [packed[:i] for i in range(0, len(packed))] + [packed + b"\0"]:
+        try:
+            other.loadDictComp(broken, "Player")
+        except zlib.error:
+            pass
+        else:
+            raise AssertionError("loadDictComp accepted a damaged payload of %d bytes" % len(broken))
+    # an unnamed block inserted in front shifts the positional names, the stale dictionary files must be refused
+    unnamed_file = os.path.join(os.path.dirname(proto_file), "unnamed.proto")
+    with open(unnamed_file, "w") as f:
+        f.write("{ string name; uint32 id; }\n")
+    unnamed = ProtoParser()
+    unnamed.buildDesc(unnamed_file)
+    unnamed.trainDict(players)
+    unnamed.saveDict()
+    with open(unnamed_file, "w") as f:
+        f.write("{ uint8 flag; }\n{ string name; uint32 id; }\n")
+    try:
+        ProtoParser().buildDesc(unnamed_file)
+    except Exception as e:
+        assert "another schema" in str(e)
+    else:
+        raise AssertionError("dictionary of another block was loaded")
+
+
+def count_records(records):
+    return sum([1 for _ in records])
+
+
+def sample_players(count):
+    return [{"name": "剑侠客%d" % i, "id": i, "married": i % 2 == 0, "friends": tuple(range(i % 4)),
+             "position": (float(i), 0.0, 1.5), "pet": {"name": "泡泡", "skill": ({"id": i}, {"id": 2})}}
+            for i in range(count)]
+
+
+def write_container(records_per_block=10, count=95):
+    parser = ProtoParser()
+    parser.buildDesc("a1.proto")
+    values = sample_players(count)
+    filename = os.path.join(tempfile.mkdtemp(), "players.npc")
+    with ContainerWriter(filename, parser, records_per_block=records_per_block) as writer:
+        for x in values:
+            writer.write(x)
+    return filename, values
+
+
+def test_container_round_trip():
+    filename, values = write_container()
+    with ContainerReader(filename) as reader:
+        assert reader.get_block_count() == 10 and reader.get_record_count() == len(values)
+        assert list(reader.iter_records()) == values
+        assert reader.read_block(3) == values[30:40]
+        ranges = reader.split(3)
+        assert ranges[0][0] == 0 and ranges[-1][1] == 10
+        assert all([ranges[i][1] == ranges[i + 1][0] for i in range(0, len(ranges) - 1)])
+        assert sum([len(list(reader.iter_records(start, stop))) for start, stop in ranges]) == len(values)
+        # sync from inside a block lands on the start of the next one
+        offsets = [x[0] for x in reader.index]
+        assert reader.sync(offsets[0]) == offsets[0]
+        assert reader.sync(offsets[2] + 1) == offsets[3]
+        assert reader.sync(offsets[-1] + 1) is None
+    assert map_block_ranges(filename, count_records, workers=2, use_threads=True) == [50, 45]
+
+
+def test_container_truncated():
+    filename, values = write_container()
+    with ContainerReader(filename) as reader:
+        offsets = [x[0] for x in reader.index]
+    # a writer that died in the middle of block 7: no footer, the last block is cut short
+    with open(filename, "rb") as f:
+        data = f.read(offsets[7] + 20)
+    with open(filename, "wb") as f:
+        f.write(data)
+    with ContainerReader(filename) as reader:
+        assert reader.get_block_count() == 7
+        assert list(reader.iter_records()) == values[:70]
+        assert reader.sync(offsets[6] + 1) is None
+    # a with-body that raised leaves no footer either, only the blocks flushed before the error are recovered
+    parser = ProtoParser()
+    parser.buildDesc("a1.proto")
+    try:
+        with ContainerWriter(filename, parser, records_per_block=10) as writer:
+            for x in values[:25]:
+                writer.write(x)
+            raise KeyError("job failed")
+    except KeyError:
+        pass
+    with ContainerReader(filename) as reader:
+        assert reader.get_block_count() == 2
+        assert list(reader.iter_records()) == values[:20]
+    with open(filename, "wb") as f:
+        f.write(data[:10])
+    try:
+        ContainerReader(filename)
+    except Exception as e:
+        assert "unexpected end of file" in str(e)
+    else:
+        raise AssertionError("truncated header was accepted")
+
+
+def test_shared_parser_threads(workers=8, count=2000):
+    parser = ProtoParser()
+    parser.buildDesc("a1.proto")
+    with open("a1.proto", "r", encoding="utf-8") as f:
+        proto_text = f.read()
+    values = sample_players(count)
+    expected_hex = [parser.dumps(x) for x in values]
+    expected_values = [parser.loads(x) for x in expected_hex]
+    done = threading.Event()
+
+    # re-parsing swaps in fresh, not yet compiled messages while the pool is encoding and decoding
+    def reparse():
+        while not done.is_set():
+            parser.parse(proto_text)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    parse_thread = threading.Thread(target=reparse)
+    parse_thread.start()
+    pool = ThreadPool(workers)
+    try:
+        for _ in range(0, 3):
+            assert pool.map(parser.dumps, values, chunksize=1) == expected_hex
+            assert pool.map(parser.loads, expected_hex, chunksize=1) == expected_values
+    finally:
+        done.set()
+        parse_thread.join()
+        pool.close()
+        pool.join()
+        sys.setswitchinterval(switch_interval)
+
+
+def test_frozen_schema():
+    parser = ProtoParser()
+    parser.buildDesc("a1.proto")
+    schema = parser.get_schema()
+    pet = schema.inner_types[schema.inner_types_str_key.index("pet")]
+    for composite in (schema, pet):
+        try:
+            composite.add_type(INT_8, "extra")
+        except Exception as e:
+            assert "frozen" in str(e)
+        else:
+            raise AssertionError("add_type changed a built schema")
+    assert "extra" not in schema.inner_types_str_key and "extra" not in pet.inner_types_str_key
+
+
+def test_messages():
+    parser = ProtoParser()
+    parser.parse("{int8 i;} first;@#$%^&{\n  string s;\n}@#$%^&{ uint32[] ids; {uint8 a;} inner; } third;\n")
+    assert list(parser.get_message_names()) == ["first", "1", "third"]
+    assert not any([parser.get_message(x).is_compiled() for x in parser.get_message_names()])
+    assert parser.get_message(None) is parser.get_message("first")
+    assert parser.dumps({"i": 1}) == "01"
+    assert parser.get_message("first").is_compiled() and not parser.get_message("1").is_compiled()
+    h = parser.dumps({"s": "ab"}, "1")
+    assert parser.get_message("1").is_compiled() and not parser.get_message("third").is_compiled()
+    assert parser.loads(h, "1") == {"s": "ab"}
+    assert parser.loads("0200010000000200000009", "third") == {"ids": (1, 2), "inner": {"a": 9}}
+    assert parser.get_message("third").is_compiled()
+    assert parser.get_schema("first").inner_types_str_key == ("i",)
 
 
 if __name__ == '__main__':
     test2()
     test3()
+    test_fragment_cache_float_sign()
+    test_fragment_cache_keeps_value_types_apart()
+    test_frozen_record_is_immutable()
+    test_string_rejects_non_text()
+    test_projection()
+    test_projection_tuple_rows()
+    test_dict_per_message()
+    test_container_round_trip()
+    test_container_truncated()
+    test_shared_parser_threads()
+    test_frozen_schema()
+    test_messages()
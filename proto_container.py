@@ -0,0 +1,262 @@
+# coding=utf-8
+"""Splittable block container for archives of encoded records.
+
+Layout, all integers little-endian:
+
+    header:  MAGIC | uint32 schema length | schema text | uint16 name length | message name
+             | uint32 records per block | sync marker
+    block:   uint32 record count | uint32 compressed size | zlib(concatenated record encodings) | sync marker
+    footer:  uint32 block count | (uint64 block offset, uint32 record count) * block count
+    trailer: uint64 footer offset | MAGIC
+
+Every block is preceded by the file's sync marker, so a reader dropped at an arbitrary byte offset can find the
+next block boundary on its own. The footer index lets separate workers decode disjoint block ranges directly.
+"""
+import multiprocessing
+import os
+import struct
+import threading
+import zlib
+from multiprocessing.pool import ThreadPool
+from proto_parser import ProtoParser, ByteArrayInputStream, encode_bytes
+
+MAGIC = b"NPC1"
+SYNC_MARKER_SIZE = 16
+DEFAULT_RECORDS_PER_BLOCK = 1024
+
+BLOCK_HEADER = struct.Struct("<II")
+INDEX_ENTRY = struct.Struct("<QI")
+TRAILER = struct.Struct("<Q4s")
+
+
+class ContainerWriter(object):
+
+    def __init__(self, filename, parser, message=None, records_per_block=DEFAULT_RECORDS_PER_BLOCK,
+                 level=zlib.Z_DEFAULT_COMPRESSION, cache=None):
+        super(ContainerWriter, self).__init__()
+        assert records_per_block > 0
+        msg = parser.get_message(message)
+        self.schema = msg.get_schema()
+        self.records_per_block = records_per_block
+        self.level = level
+        self.cache = cache
+        self.sync_marker = os.urandom(SYNC_MARKER_SIZE)
+        self.pending = []
+        self.index = []
+        self.f = open(filename, "wb")
+        schema_text = msg.proto_text.encode("utf-8")
+        name = msg.name.encode("utf-8")
+        self.f.write(MAGIC)
+        self.f.write(struct.pack("<I", len(schema_text)) + schema_text)
+        self.f.write(struct.pack("<H", len(name)) + name)
+        self.f.write(struct.pack("<I", records_per_block))
+        self.f.write(self.sync_marker)
+
+    def write(self, runtime_value):
+        self.pending.append(encode_bytes(self.schema, runtime_value, self.cache))
+        if len(self.pending) >= self.records_per_block:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.pending:
+            return
+        data = zlib.compress(b"".join(self.pending), self.level)
+        self.index.append((self.f.tell(), len(self.pending)))
+        self.f.write(BLOCK_HEADER.pack(len(self.pending), len(data)))
+        self.f.write(data)
+        self.f.write(self.sync_marker)
+        self.pending = []
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush_block()
+        footer_offset = self.f.tell()
+        self.f.write(struct.pack("<I", len(self.index)))
+        for entry in self.index:
+            self.f.write(INDEX_ENTRY.pack(*entry))
+        self.f.write(TRAILER.pack(footer_offset, MAGIC))
+        self.f.close()
+        self.f = None
+
+    def __enter__(self):
+        return self
+
+    # 写入中途出错时不写footer, 文件看起来就和写入方崩溃一样, 读取方只会经scan_index恢复已完整写入的block
+    def abort(self):
+        if self.f is None:
+            return
+        self.f.close()
+        self.f = None
+        self.pending = []
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class ContainerReader(object):
+    """Reads a container file. Blocks may be read from several threads, file access is serialized by a lock
+    while decompression and decoding run outside of it."""
+
+    # tuple_rows is handed to the ProtoParser built for the embedded schema.
+    def __init__(self, filename, tuple_rows=False):
+        super(ContainerReader, self).__init__()
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.f = open(filename, "rb")
+        try:
+            if self.f.read(len(MAGIC)) != MAGIC:
+                self.raise_error("%s is not a container file" % filename)
+            schema_text = self.f.read(self.read_struct("<I"))
+            self.message_name = self.f.read(self.read_struct("<H")).decode("utf-8")
+            self.records_per_block = self.read_struct("<I")
+            self.sync_marker = self.f.read(SYNC_MARKER_SIZE)
+            self.data_offset = self.f.tell()
+            self.data_end = self.data_offset
+            self.parser = ProtoParser(tuple_rows)
+            self.parser.parse(schema_text)
+            self.schema = self.parser.get_schema()
+            self.index = self.read_index()
+        except Exception:
+            self.f.close()
+            raise
+
+    def read_struct(self, fmt):
+        size = struct.calcsize(fmt)
+        data = self.f.read(size)
+        if len(data) != size:
+            self.raise_error("unexpected end of file")
+        return struct.unpack(fmt, data)[0]
+
+    def read_index(self):
+        self.f.seek(0, os.SEEK_END)
+        file_size = self.f.tell()
+        if file_size - self.data_offset >= TRAILER.size:
+            self.f.seek(file_size - TRAILER.size)
+            footer_offset, magic = TRAILER.unpack(self.f.read(TRAILER.size))
+            if magic == MAGIC and self.data_offset <= footer_offset < file_size:
+                self.data_end = footer_offset
+                self.f.seek(footer_offset)
+                count = self.read_struct("<I")
+                data = self.f.read(count * INDEX_ENTRY.size)
+                return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(0, count)]
+        # 没有footer(比如写入方中途崩溃), 沿着block逐个走一遍重建索引
+        return self.scan_index(file_size)
+
+    def scan_index(self, file_size):
+        index = []
+        offset = self.data_offset
+        while offset + BLOCK_HEADER.size <= file_size:
+            self.f.seek(offset)
+            count, size = BLOCK_HEADER.unpack(self.f.read(BLOCK_HEADER.size))
+            end = offset + BLOCK_HEADER.size + size
+            self.f.seek(end)
+            if self.f.read(SYNC_MARKER_SIZE) != self.sync_marker:
+                break
+            index.append((offset, count))
+            offset = end + SYNC_MARKER_SIZE
+        self.data_end = offset
+        return index
+
+    # return the offset of the first block starting at or after offset, or None if there is none.
+    def sync(self, offset, chunk_size=65536):
+        buf_offset = max(offset, self.data_offset) - SYNC_MARKER_SIZE
+        with self.lock:
+            self.f.seek(buf_offset)
+            buf = b""
+            while buf_offset < self.data_end:
+                chunk = self.f.read(chunk_size)
+                if not chunk:
+                    break
+                buf += chunk
+                pos = buf.find(self.sync_marker)
+                if pos >= 0:
+                    block_offset = buf_offset + pos + SYNC_MARKER_SIZE
+                    return block_offset if block_offset < self.data_end else None
+                # 保留尾部, marker可能正好跨两次读取
+                drop = max(0, len(buf) - SYNC_MARKER_SIZE + 1)
+                buf_offset += drop
+                buf = buf[drop:]
+        return None
+
+    def get_block_count(self):
+        return len(self.index)
+
+    def get_record_count(self):
+        return sum([x[1] for x in self.index])
+
+    def read_block_at(self, offset):
+        with self.lock:
+            self.f.seek(offset)
+            count, size = BLOCK_HEADER.unpack(self.f.read(BLOCK_HEADER.size))
+            data = self.f.read(size)
+        stream = ByteArrayInputStream(zlib.decompress(data))
+        return [self.schema.deserialize(stream) for _ in range(0, count)]
+
+    def read_block(self, block):
+        return self.read_block_at(self.index[block][0])
+
+    # yield the records of blocks [start, stop)
+    def iter_records(self, start=0, stop=None):
+        if stop is None:
+            stop = len(self.index)
+        for block in range(start, stop):
+            for record in self.read_block(block):
+                yield record
+
+    def split(self, parts):
+        """Split the blocks into at most `parts` contiguous [start, stop) ranges holding similar record counts."""
+        assert parts > 0
+        total = self.get_record_count()
+        ranges = []
+        start = 0
+        seen = 0
+        for block in range(0, len(self.index)):
+            seen += self.index[block][1]
+            if seen * parts >= total * (len(ranges) + 1):
+                ranges.append((start, block + 1))
+                start = block + 1
+        if start < len(self.index):
+            ranges.append((start, len(self.index)))
+        return ranges
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def raise_error(self, msg):
+        raise Exception("CONTAINER ERROR: " + msg)
+
+
+def read_block_range(filename, start, stop):
+    with ContainerReader(filename) as reader:
+        return list(reader.iter_records(start, stop))
+
+
+def _process_block_range(args):
+    filename, func, start, stop = args
+    with ContainerReader(filename) as reader:
+        return func(reader.iter_records(start, stop))
+
+
+def map_block_ranges(filename, func, workers=None, use_threads=False):
+    """Apply func to the records of each of `workers` disjoint block ranges in parallel, return the results in
+    block order. Every worker opens the file on its own; with processes func must be picklable."""
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    with ContainerReader(filename) as reader:
+        ranges = reader.split(workers)
+    pool = ThreadPool(workers) if use_threads else multiprocessing.Pool(workers)
+    try:
+        return pool.map(_process_block_range, [(filename, func, start, stop) for start, stop in ranges])
+    finally:
+        pool.close()
+        pool.join()
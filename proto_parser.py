@@ -1,17 +1,23 @@
 # coding=utf-8
+import operator
+import os
 import struct
+import threading
 import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
 
 # Constant Definitions
-HexStringMap = ['0', '1', '2', '3', '4', '5', '6',
-                '7', '8', '9', 'a', 'b', 'c', 'd', 'e', 'f']
 UNKNOWN_SIZE = -1
 BlankSymbol = [" ", "\n", "\r", "\t"]
+ZDICT_MAX_SIZE = 32768  # deflate 的窗口大小, 字典再长也用不上
+ZDICT_FILE_SUFFIX = ".zdict"
+ZDICT_FILE_MAGIC = b"NPZD"
+ZDICT_FILE_HEADER = struct.Struct("<4sII")  # magic, schema id, dictionary id
 
 # Feature switches
 
 USE_RAW_BYTES_AS_STRING_LENGTH = True
-USE_UNICODE_AS_DICT_KEY = False
 
 
 def is_alphabet(ch):
@@ -36,34 +42,18 @@ def is_valid_c_style_var_name(ch, first=False):
     return is_alphabet(ch) or is_underscore(ch) or is_digit(ch)
 
 
-def convert_stringify_byte_array_to_list(stringify_bytes):
-    return [ord(x) for x in stringify_bytes]
-
-
-def convert_byte_list_to_stringify_byte_array(bytes_list):
-    return "".join([chr(x) for x in bytes_list])
-
-
 def WrapToUnicode(original):
-    return unicode(original, encoding="utf-8")
+    if isinstance(original, (bytes, bytearray)):
+        return original.decode("utf-8")
+    return original
 
 
 def ToHexString(data):
-    result = ""
-    for b in data:
-        low = b & 0x0F
-        high = (b >> 4) & 0x0F
-        result += HexStringMap[high] + HexStringMap[low]
-    return result
+    return data.hex()
 
 
 def ParseHexString(hex_str):
-    data = []
-    for x in range(0, len(hex_str), 2):
-        high = int(hex_str[x], 16) << 4
-        low = int(hex_str[x + 1], 16)
-        data.append(low | high)
-    return data
+    return bytes.fromhex(hex_str)
 
 
 class Type(object):
@@ -79,19 +69,46 @@ class Type(object):
     def deserialize(self, byte_stream_reader):
         pass
 
+    # encoded size in bytes if it does not depend on the value, otherwise UNKNOWN_SIZE.
+    def get_fixed_size(self):
+        return UNKNOWN_SIZE
+
+    # move byte_stream_reader past one encoded value without materializing it.
+    def skip(self, byte_stream_reader):
+        self.deserialize(byte_stream_reader)
+
+    # Schemas are shared across threads once built, freezing makes accidental mutation fail loudly.
+    def freeze(self):
+        return self
+
 
 class PrimitiveType(Type):
-    def __init__(self, name, size):
+    # fmt is the struct format of a fixed-size primitive, variable-size primitives have none.
+    def __init__(self, name, size, fmt=None):
         super(PrimitiveType, self).__init__()
         self.name = name
         self.size = size
+        self.fmt = fmt
+        self.struct = struct.Struct("<" + fmt) if fmt is not None else None
 
     def get_size(self):
         return self.size
 
+    def get_fixed_size(self):
+        return self.size
+
+    def skip(self, byte_stream_reader):
+        byte_stream_reader.advance(self.size)
+
     def get_descriptor(self):
         return self.name
 
+    def serialize(self, runtime_value):
+        return self.struct.pack(runtime_value)
+
+    def deserialize(self, byte_stream_reader):
+        return byte_stream_reader.unpack(self.struct)
+
     def __eq__(self, o):
         if o is None:
             return False
@@ -103,12 +120,21 @@ class PrimitiveType(Type):
             return True
         return False
 
+    def __hash__(self):
+        return hash((self.name, self.size))
+
 
 class VariableSizePrimitiveType(PrimitiveType):
 
     def __init__(self, name, size):
         super(VariableSizePrimitiveType, self).__init__(name, size)
 
+    def get_fixed_size(self):
+        return UNKNOWN_SIZE
+
+    def skip(self, byte_stream_reader):
+        self.deserialize(byte_stream_reader)
+
     def calc_size(self, runtime_value):
         # default implementation
         return self.get_size()
@@ -119,8 +145,13 @@ class CompositeType(Type):
         super(CompositeType, self).__init__()
         self.inner_types = []
         self.inner_types_str_key = []
+        self.frozen = False
+        self.fixed_size = None
+        self.skip_steps = None
 
     def add_type(self, inner_type, type_str_key):
+        if self.frozen:
+            raise Exception("can not add %s to a frozen composite type" % type_str_key)
         self.inner_types.append(inner_type)
         self.inner_types_str_key.append(type_str_key)
 
@@ -136,10 +167,56 @@ class CompositeType(Type):
     def get_size(self):
         return sum([x.get_size() for x in self.inner_types])
 
+    # computed once by freeze(), skipping is on the projection hot path.
+    def get_fixed_size(self):
+        if self.fixed_size is not None:
+            return self.fixed_size
+        return self.calc_fixed_size()
+
+    def calc_fixed_size(self):
+        size = 0
+        for typ in self.inner_types:
+            typ_size = typ.get_fixed_size()
+            if typ_size == UNKNOWN_SIZE:
+                return UNKNOWN_SIZE
+            size += typ_size
+        return size
+
+    def skip(self, byte_stream_reader):
+        size = self.get_fixed_size()
+        if size != UNKNOWN_SIZE:
+            byte_stream_reader.advance(size)
+            return
+        skip_steps = self.skip_steps
+        if skip_steps is None:
+            skip_steps = self.compile_skip_steps()
+        for step in skip_steps:
+            if step.__class__ is int:
+                byte_stream_reader.advance(step)
+            else:
+                step.skip(byte_stream_reader)
+
+    # return a byte count for each run of adjacent fixed-size fields, and the type of each other field.
+    def compile_skip_steps(self):
+        steps = []
+        skip_bytes = 0
+        for typ in self.inner_types:
+            typ_size = typ.get_fixed_size()
+            if typ_size != UNKNOWN_SIZE:
+                skip_bytes += typ_size
+                continue
+            if skip_bytes:
+                steps.append(skip_bytes)
+                skip_bytes = 0
+            steps.append(typ)
+        if skip_bytes:
+            steps.append(skip_bytes)
+        return tuple(steps)
+
     def get_descriptor(self):
         res = []
         m = self.generate_type_map()
-        for x in m.iterkeys():
+        for x in m.keys():
             typ = x
             count = m[x]
             res.append("%s_%s" % (typ.get_descriptor(), count))
@@ -156,176 +233,302 @@ class CompositeType(Type):
         o_self = o.generate_type_map()
         return m_self == o_self
 
-    def serialize(self, runtime_value):
-        assert isinstance(runtime_value, dict)
+    def __hash__(self):
+        return hash(frozenset(self.generate_type_map().items()))
+
+    def freeze(self):
+        if not self.frozen:
+            self.frozen = True
+            self.inner_types = tuple([x.freeze() for x in self.inner_types])
+            self.inner_types_str_key = tuple(self.inner_types_str_key)
+            self.fixed_size = self.calc_fixed_size()
+            self.skip_steps = self.compile_skip_steps()
+        return self
+
+    def serialize(self, runtime_value, cache=None):
+        assert isinstance(runtime_value, (dict, FrozenRecord))
         res = []
-        for i in range(0, len(self.inner_types)):
-            typ = self.inner_types[i]
-            typ_key = self.inner_types_str_key[i]
+        for typ, typ_key in zip(self.inner_types, self.inner_types_str_key):
             value_obj = runtime_value.get(typ_key)
             if value_obj is None:
                 raise Exception("%s is not found in runtime_value" % typ_key)
-            res += typ.serialize(value_obj)
-        return res
+            res.append(serialize_fragment(typ, value_obj, cache))
+        return b"".join(res)
 
     def deserialize(self, byte_stream_reader):
         res = {}
-        for i in range(0, len(self.inner_types)):
-            typ = self.inner_types[i]
-            typ_key = self.inner_types_str_key[i]
-            if not USE_UNICODE_AS_DICT_KEY:
-                typ_key = typ_key.encode("utf-8")  # convert unicode to str-typed utf8 content.
+        for typ, typ_key in zip(self.inner_types, self.inner_types_str_key):
             res[typ_key] = typ.deserialize(byte_stream_reader)
         return res
 
 
 class ArrayType(Type):
 
-    def __init__(self, element_type, length):
+    # tuple_rows makes an array of fixed-size composites decode its elements as flat tuples instead of dicts.
+    def __init__(self, element_type, length, tuple_rows=False):
         super(ArrayType, self).__init__()
         self.element_type = element_type
         self.length = length
         self.fixed_length = length != UNKNOWN_SIZE
+        self.tuple_rows = tuple_rows
+        self.record_layout = None
+        self.fixed_size = None
 
     def get_size(self):
         if not self.fixed_length:
             return self.fixed_length * self.element_type.get_size()
         return UNKNOWN_SIZE
 
+    # computed once by freeze(), skipping is on the projection hot path.
+    def get_fixed_size(self):
+        if self.fixed_size is not None:
+            return self.fixed_size
+        return self.calc_fixed_size()
+
+    def calc_fixed_size(self):
+        element_size = self.element_type.get_fixed_size()
+        if not self.fixed_length or element_size == UNKNOWN_SIZE:
+            return UNKNOWN_SIZE
+        return self.length * element_size
+
+    def skip(self, byte_stream_reader):
+        read_length = self.length
+        if not self.fixed_length:
+            read_length = UINT_16.deserialize(byte_stream_reader)
+        element_size = self.element_type.get_fixed_size()
+        if element_size != UNKNOWN_SIZE:
+            byte_stream_reader.advance(read_length * element_size)
+            return
+        for i in range(0, read_length):
+            self.element_type.skip(byte_stream_reader)
+
     def get_descriptor(self):
         return self.element_type.get_descriptor() + "[]"
 
-    def serialize(self, runtime_value):
+    def freeze(self):
+        self.element_type.freeze()
+        self.fixed_size = self.calc_fixed_size()
+        if self.record_layout is None and isinstance(self.element_type, CompositeType) \
+                and self.element_type.get_fixed_size() > 0:
+            self.record_layout = RecordLayout(self.element_type)
+        return self
+
+    def serialize(self, runtime_value, cache=None):
+        if self.record_layout is not None:
+            return self.record_layout.pack(runtime_value, self.fixed_length)
         res = []
         if not self.fixed_length:
             # 不是定长数组，在序列化数据中写入长度信息
-            res += UINT_16.serialize(len(runtime_value))
+            res.append(UINT_16.serialize(len(runtime_value)))
+        element_type = self.element_type
         for x in runtime_value:
-            res += self.element_type.serialize(x)
-        return res
+            res.append(serialize_fragment(element_type, x, cache))
+        return b"".join(res)
 
     def deserialize(self, byte_stream_reader):
         read_length = self.length
         if not self.fixed_length:
             read_length = UINT_16.deserialize(byte_stream_reader)
-        res = []
-        for i in range(0, read_length):
-            x = self.element_type.deserialize(byte_stream_reader)
-            res.append(x)
-
+        if self.record_layout is not None:
+            return self.record_layout.unpack(byte_stream_reader, read_length, self.tuple_rows)
+        deserialize = self.element_type.deserialize
         # OJ prefers tuple than list for array-type, so we convert it to make it happy.
-        return tuple(res)
+        return tuple([deserialize(byte_stream_reader) for i in range(0, read_length)])
 
 
-# Then we define some common primitive type here.
+# Bulk codec of arrays of fixed-size composites
 
 
-class Int8(PrimitiveType):
-    def __init__(self):
-        super(Int8, self).__init__("int8", 1)
+class RecordLayout(object):
+    """A single struct.Struct covering one element of an array of fixed-size composites.
 
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<b", runtime_value))
-
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<b", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+    A whole array is decoded with one iter_unpack and encoded with one pack_into loop. Rows are flat tuples of the
+    element's primitives in declaration order, nested composites and arrays flattened, and are rebuilt into dicts
+    unless tuple rows are asked for. Either form is accepted when encoding.
+    """
+    SCALAR = 0
+    PRIMITIVE_ARRAY = 1
+    COMPOSITE = 2
+    COMPOSITE_ARRAY = 3
 
+    def __init__(self, composite):
+        super(RecordLayout, self).__init__()
+        fmt, self.shape = self.compile_shape(composite)
+        self.struct = struct.Struct("<" + fmt)
+        self.keys = tuple([x[0] for x in self.shape])
+        self.flat = all([x[2] == RecordLayout.SCALAR for x in self.shape])
+        if self.flat and len(self.keys) > 1:
+            self.getter = operator.itemgetter(*self.keys)
+        else:
+            self.getter = None
 
-class UInt8(PrimitiveType):
-    def __init__(self):
-        super(UInt8, self).__init__("uint8", 1)
+    # return struct format, shape. Each shape entry is (key, width in row, kind, sub shape).
+    @staticmethod
+    def compile_shape(composite):
+        fmt = []
+        shape = []
+        for typ, typ_key in zip(composite.inner_types, composite.inner_types_str_key):
+            if isinstance(typ, PrimitiveType):
+                fmt.append(typ.fmt)
+                shape.append((typ_key, 1, RecordLayout.SCALAR, None))
+            elif isinstance(typ, CompositeType):
+                sub_fmt, sub_shape = RecordLayout.compile_shape(typ)
+                fmt.append(sub_fmt)
+                shape.append((typ_key, RecordLayout.shape_width(sub_shape), RecordLayout.COMPOSITE, sub_shape))
+            elif isinstance(typ.element_type, PrimitiveType):
+                fmt.append("%d%s" % (typ.length, typ.element_type.fmt))
+                shape.append((typ_key, typ.length, RecordLayout.PRIMITIVE_ARRAY, None))
+            else:
+                sub_fmt, sub_shape = RecordLayout.compile_shape(typ.element_type)
+                fmt.append(sub_fmt * typ.length)
+                shape.append((typ_key, RecordLayout.shape_width(sub_shape) * typ.length,
+                              RecordLayout.COMPOSITE_ARRAY, sub_shape))
+        return "".join(fmt), shape
 
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<B", runtime_value))
+    @staticmethod
+    def shape_width(shape):
+        return sum([x[1] for x in shape])
 
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<B", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+    @staticmethod
+    def build(shape, row, pos):
+        res = {}
+        for key, width, kind, sub_shape in shape:
+            if kind == RecordLayout.SCALAR:
+                res[key] = row[pos]
+            elif kind == RecordLayout.PRIMITIVE_ARRAY:
+                res[key] = row[pos:pos + width]
+            elif kind == RecordLayout.COMPOSITE:
+                res[key] = RecordLayout.build(sub_shape, row, pos)
+            else:
+                sub_width = RecordLayout.shape_width(sub_shape)
+                res[key] = tuple([RecordLayout.build(sub_shape, row, x) for x in range(pos, pos + width, sub_width)])
+            pos += width
+        return res
 
+    # return the row positions of the fields selected by a projection field tree, in declaration order.
+    @staticmethod
+    def select_columns(shape, tree, pos=0):
+        columns = []
+        for key, width, kind, sub_shape in shape:
+            if key in tree:
+                sub_tree = tree[key]
+                if sub_tree is None:
+                    columns.extend(range(pos, pos + width))
+                elif kind == RecordLayout.COMPOSITE:
+                    columns.extend(RecordLayout.select_columns(sub_shape, sub_tree, pos))
+                elif kind == RecordLayout.COMPOSITE_ARRAY:
+                    sub_width = RecordLayout.shape_width(sub_shape)
+                    for x in range(pos, pos + width, sub_width):
+                        columns.extend(RecordLayout.select_columns(sub_shape, sub_tree, x))
+                else:
+                    raise Exception("%s has no sub fields to select" % key)
+            pos += width
+        return columns
 
-class Int16(PrimitiveType):
-    def __init__(self):
-        super(Int16, self).__init__("int16", 2)
+    @staticmethod
+    def flatten(shape, value, out):
+        for key, width, kind, sub_shape in shape:
+            value_obj = value.get(key)
+            if value_obj is None:
+                raise Exception("%s is not found in runtime_value" % key)
+            if kind == RecordLayout.SCALAR:
+                out.append(value_obj)
+            elif kind == RecordLayout.PRIMITIVE_ARRAY:
+                out.extend(value_obj)
+            elif kind == RecordLayout.COMPOSITE:
+                RecordLayout.flatten(sub_shape, value_obj, out)
+            else:
+                for x in value_obj:
+                    RecordLayout.flatten(sub_shape, x, out)
+        return out
+
+    def to_row(self, runtime_value):
+        if isinstance(runtime_value, tuple):
+            return runtime_value
+        if self.getter is not None:
+            try:
+                return self.getter(runtime_value)
+            except KeyError as e:
+                raise Exception("%s is not found in runtime_value" % e.args[0])
+        return self.flatten(self.shape, runtime_value, [])
+
+    def pack(self, runtime_value, fixed_length):
+        offset = 0 if fixed_length else UINT_16.size
+        size = self.struct.size
+        buf = bytearray(offset + len(runtime_value) * size)
+        if not fixed_length:
+            # 不是定长数组，在序列化数据中写入长度信息
+            UINT_16.struct.pack_into(buf, 0, len(runtime_value))
+        pack_into = self.struct.pack_into
+        to_row = self.to_row
+        for x in runtime_value:
+            pack_into(buf, offset, *to_row(x))
+            offset += size
+        return bytes(buf)
+
+    def unpack(self, byte_stream_reader, count, tuple_rows):
+        size = count * self.struct.size
+        start = byte_stream_reader.index
+        data = memoryview(byte_stream_reader.arr)[start:start + size]
+        if len(data) != size:
+            raise Exception("expect %s bytes of array data, but only %s left" % (size, len(data)))
+        byte_stream_reader.advance(size)
+        rows = self.struct.iter_unpack(data)
+        if tuple_rows:
+            return tuple(rows)
+        if self.flat:
+            keys = self.keys
+            return tuple([dict(zip(keys, x)) for x in rows])
+        shape = self.shape
+        return tuple([RecordLayout.build(shape, x, 0) for x in rows])
 
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<h", runtime_value))
 
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<h", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+# Then we define some common primitive type here.
 
 
-class UInt16(PrimitiveType):
+class Int8(PrimitiveType):
     def __init__(self):
-        super(UInt16, self).__init__("uint16", 2)
+        super(Int8, self).__init__("int8", 1, "b")
 
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<H", runtime_value))
 
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<H", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+class UInt8(PrimitiveType):
+    def __init__(self):
+        super(UInt8, self).__init__("uint8", 1, "B")
 
 
-class Int32(PrimitiveType):
+class Int16(PrimitiveType):
     def __init__(self):
-        super(Int32, self).__init__("int32", 4)
+        super(Int16, self).__init__("int16", 2, "h")
 
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<i", runtime_value))
 
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<i", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+class UInt16(PrimitiveType):
+    def __init__(self):
+        super(UInt16, self).__init__("uint16", 2, "H")
 
 
-class UInt32(PrimitiveType):
+class Int32(PrimitiveType):
     def __init__(self):
-        super(UInt32, self).__init__("uint32", 4)
+        super(Int32, self).__init__("int32", 4, "i")
 
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<I", runtime_value))
 
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<I", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+class UInt32(PrimitiveType):
+    def __init__(self):
+        super(UInt32, self).__init__("uint32", 4, "I")
 
 
 class Float(PrimitiveType):
     def __init__(self):
-        super(Float, self).__init__("float", 4)
-
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<f", runtime_value))
-
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<f", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+        super(Float, self).__init__("float", 4, "f")
 
 
 class Double(PrimitiveType):
     def __init__(self):
-        super(Double, self).__init__("double", 8)
-
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<d", runtime_value))
-
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<d", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+        super(Double, self).__init__("double", 8, "d")
 
 
 class Bool(PrimitiveType):
     def __init__(self):
-        super(Bool, self).__init__("bool", 1)
-
-    def serialize(self, runtime_value):
-        return convert_stringify_byte_array_to_list(struct.pack("<?", runtime_value))
-
-    def deserialize(self, byte_stream_reader):
-        return struct.unpack("<?", convert_byte_list_to_stringify_byte_array(byte_stream_reader.read(self.get_size())))[
-            0]
+        super(Bool, self).__init__("bool", 1, "?")
 
 
 class String(VariableSizePrimitiveType):
@@ -336,39 +539,47 @@ class String(VariableSizePrimitiveType):
     def calc_size(self, runtime_value):
         return len(WrapToUnicode(runtime_value))
 
+    # runtime_value is str, or bytes already holding utf-8 content.
     def serialize(self, runtime_value):
+        if not isinstance(runtime_value, (str, bytes, bytearray)):
+            raise TypeError("string expects str or utf-8 bytes, but %s occurred" % type(runtime_value).__name__)
         if USE_RAW_BYTES_AS_STRING_LENGTH:
             return self.__serialize_use_raw_data_length(runtime_value)
 
         utf_8_repr_runtime_value = WrapToUnicode(runtime_value)
-        str_bytes = bytearray(utf_8_repr_runtime_value, encoding="utf-8")
-        return UINT_16.serialize(len(utf_8_repr_runtime_value)) + [int(x) for x in str_bytes]
+        str_bytes = utf_8_repr_runtime_value.encode("utf-8")
+        return UINT_16.serialize(len(utf_8_repr_runtime_value)) + str_bytes
 
     @staticmethod
     def __serialize_use_raw_data_length(runtime_value):
-        str_bytes = bytearray(WrapToUnicode(runtime_value), encoding="utf-8")
-        data = [int(x) for x in str_bytes]
-        length = UINT_16.serialize(len(data))
-        return length + data
+        data = runtime_value.encode("utf-8") if isinstance(runtime_value, str) else bytes(runtime_value)
+        return UINT_16.serialize(len(data)) + data
 
     def deserialize(self, byte_stream_reader):
         if USE_RAW_BYTES_AS_STRING_LENGTH:
             return self.__deserialize_use_raw_data_length(byte_stream_reader)
         # 先读最开始的两个字节，看看整个字符串有多长
         str_length = UINT_16.deserialize(byte_stream_reader)
-        str_content = ""
+        start = byte_stream_reader.index
+        for i in range(0, str_length):
+            first_byte = byte_stream_reader.read(1)[0]
+            byte_stream_reader.advance(self.__get_unicode_continuous_bytes_count(first_byte) - 1)
+        return str(byte_stream_reader.arr[start:byte_stream_reader.index], "utf-8")
+
+    def skip(self, byte_stream_reader):
+        str_length = UINT_16.deserialize(byte_stream_reader)
+        if USE_RAW_BYTES_AS_STRING_LENGTH:
+            byte_stream_reader.advance(str_length)
+            return
+        # 长度是字符数, 只能逐个字符根据首字节跳过
         for i in range(0, str_length):
-            content = byte_stream_reader.read(1)
-            bytes_count = self.__get_unicode_continuous_bytes_count(content[0])
-            content += byte_stream_reader.read(bytes_count - 1)
-            str_content += bytearray(convert_byte_list_to_stringify_byte_array(content)).decode(encoding="utf-8")
-        return str_content
+            first_byte = byte_stream_reader.read(1)[0]
+            byte_stream_reader.advance(self.__get_unicode_continuous_bytes_count(first_byte) - 1)
 
     @staticmethod
     def __deserialize_use_raw_data_length(byte_stream_reader):
         str_bytes_length = UINT_16.deserialize(byte_stream_reader)
-        raw_content = byte_stream_reader.read(str_bytes_length)
-        return bytearray(convert_byte_list_to_stringify_byte_array(raw_content)).decode("utf-8").encode("utf-8")
+        return str(byte_stream_reader.read(str_bytes_length), "utf-8")
 
     @staticmethod
     def __get_unicode_continuous_bytes_count(first_byte):
@@ -395,6 +606,326 @@ TypeNamingMap = {x.name: x for x in [
     INT_8, UINT_8, INT_16, UINT_16, INT_32, UINT_32, FLOAT, DOUBLE, BOOL, STRING]}
 
 
+# Encoded-fragment cache
+
+
+class FrozenRecord(Mapping):
+    """An immutable, hashable mapping accepted wherever a composite value is. Composite sub-values built from
+    FrozenRecords and tuples can be served from a FragmentCache."""
+    __slots__ = ("fields", "hash_value", "fragment_key")
+
+    def __init__(self, *args, **kwargs):
+        super(FrozenRecord, self).__init__()
+        self.fields = dict(*args, **kwargs)
+        self.hash_value = None
+        self.fragment_key = None
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return "FrozenRecord(%r)" % self.fields
+
+    def get(self, key, default=None):
+        return self.fields.get(key, default)
+
+    def __hash__(self):
+        if self.hash_value is None:
+            self.hash_value = hash(frozenset(self.fields.items()))
+        return self.hash_value
+
+    def get_fragment_key(self):
+        if self.fragment_key is None:
+            self.fragment_key = (FrozenRecord, frozenset([(k, fragment_key(v)) for k, v in self.fields.items()]))
+        return self.fragment_key
+
+    def __reduce__(self):
+        return FrozenRecord, (self.fields,)
+
+
+def fragment_key(runtime_value):
+    """Cache key of a value that only matches values encoding to the same bytes.
+
+    Plain equality is not enough: 0.0 == -0.0 and 1 == 1.0 == True, yet they encode differently or not at all for
+    the same type. Every leaf is tagged with its python type and floats are compared by their exact hex form.
+    Raises TypeError for values holding unhashable parts such as plain dicts.
+    """
+    if isinstance(runtime_value, FrozenRecord):
+        return runtime_value.get_fragment_key()
+    if isinstance(runtime_value, tuple):
+        return tuple, tuple([fragment_key(x) for x in runtime_value])
+    if isinstance(runtime_value, float):
+        return float, runtime_value.hex()
+    key = (type(runtime_value), runtime_value)
+    hash(key)
+    return key
+
+
+class FragmentCache(object):
+    """A bounded LRU cache of the encoded bytes of immutable composite and array values, keyed by type and
+    fragment_key(value).
+
+    Only tuples and FrozenRecords are looked up, anything else is encoded as usual. A cache may be shared by
+    threads, hits and misses are counted for tuning maxsize.
+    """
+
+    def __init__(self, maxsize=1024):
+        super(FragmentCache, self).__init__()
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def serialize(self, typ, runtime_value):
+        if not isinstance(runtime_value, (tuple, FrozenRecord)):
+            return typ.serialize(runtime_value, self)
+        # 类型按对象区分, 结构相同的两个字段也不共用缓存; 条目里保留类型引用, 防止id被复用
+        try:
+            key = (id(typ), fragment_key(runtime_value))
+        except TypeError:
+            # 元素里有普通dict, 这一层没法缓存, 但内层的FrozenRecord仍然可以
+            return typ.serialize(runtime_value, self)
+        with self.lock:
+            entry = self.fragments.pop(key, None)
+            if entry is not None and entry[0] is typ:
+                self.fragments[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        data = typ.serialize(runtime_value, self)
+        with self.lock:
+            self.fragments[key] = (typ, data)
+            while len(self.fragments) > self.maxsize:
+                self.fragments.popitem(last=False)
+        return data
+
+    def get_stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.fragments), "maxsize": self.maxsize}
+
+    def clear(self):
+        with self.lock:
+            self.fragments.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def serialize_fragment(typ, runtime_value, cache):
+    if cache is None or isinstance(typ, PrimitiveType):
+        return typ.serialize(runtime_value)
+    return cache.serialize(typ, runtime_value)
+
+
+# Projection decode
+
+
+class Projection(object):
+    """A decode plan for a composite type that materializes only the selected field paths.
+
+    Paths are dot separated, a path through an array of composites selects the field of every element. Unselected
+    fields are skipped, adjacent fixed-size ones with a single jump. The plan is immutable and decodes like a type,
+    so it can be handed to decode() in place of the schema.
+
+    Like a full decode, arrays of fixed-size composites of a tuple_rows parser yield flat tuples, holding only the
+    selected columns in declaration order.
+    """
+    SKIP_BYTES = 0
+    SKIP_TYPE = 1
+    READ = 2
+    PROJECT = 3
+
+    # tree maps selected field names to the tree of their selected sub fields, or None to select the whole field.
+    def __init__(self, composite, tree, read_to_end=False):
+        super(Projection, self).__init__()
+        self.steps = tuple(self.compile_steps(composite, tree, read_to_end))
+
+    @staticmethod
+    def build_field_tree(fields):
+        tree = {}
+        for path in fields:
+            node = tree
+            parts = path.split(".")
+            for part in parts[:-1]:
+                if part in node and node[part] is None:
+                    break  # 整个字段已经被选中
+                node = node.setdefault(part, {})
+            else:
+                node[parts[-1]] = None
+        return tree
+
+    @staticmethod
+    def compile_steps(composite, tree, read_to_end):
+        steps = []
+        skip_bytes = 0
+        for i in range(0, len(composite.inner_types)):
+            typ = composite.inner_types[i]
+            typ_key = composite.inner_types_str_key[i]
+            if typ_key not in tree:
+                typ_size = typ.get_fixed_size()
+                if typ_size != UNKNOWN_SIZE:
+                    skip_bytes += typ_size
+                    continue
+                if skip_bytes:
+                    steps.append((Projection.SKIP_BYTES, None, skip_bytes))
+                    skip_bytes = 0
+                steps.append((Projection.SKIP_TYPE, None, typ))
+                continue
+            if skip_bytes:
+                steps.append((Projection.SKIP_BYTES, None, skip_bytes))
+                skip_bytes = 0
+            sub_tree = tree[typ_key]
+            if sub_tree is None:
+                steps.append((Projection.READ, typ_key, typ))
+            else:
+                steps.append((Projection.PROJECT, typ_key, Projection.compile_sub_projection(typ, typ_key, sub_tree)))
+        unknown = set(tree.keys()) - set(composite.inner_types_str_key)
+        if unknown:
+            raise Exception("%s is not found in schema" % ", ".join(sorted(unknown)))
+        if read_to_end:
+            if skip_bytes:
+                steps.append((Projection.SKIP_BYTES, None, skip_bytes))
+        else:
+            # 最后一个选中字段之后的内容不需要再跳过
+            while steps and steps[-1][0] in (Projection.SKIP_BYTES, Projection.SKIP_TYPE):
+                steps.pop()
+        return steps
+
+    @staticmethod
+    def compile_sub_projection(typ, typ_key, sub_tree):
+        if isinstance(typ, CompositeType):
+            return Projection(typ, sub_tree, True)
+        if isinstance(typ, ArrayType) and isinstance(typ.element_type, CompositeType):
+            return ArrayProjection(typ, Projection(typ.element_type, sub_tree, True), sub_tree)
+        raise Exception("%s has no sub fields to select" % typ_key)
+
+    def deserialize(self, byte_stream_reader):
+        res = {}
+        for action, res_key, arg in self.steps:
+            if action == Projection.SKIP_BYTES:
+                byte_stream_reader.advance(arg)
+            elif action == Projection.SKIP_TYPE:
+                arg.skip(byte_stream_reader)
+            else:
+                res[res_key] = arg.deserialize(byte_stream_reader)
+        return res
+
+
+class ArrayProjection(object):
+
+    def __init__(self, array_type, element_projection, tree):
+        super(ArrayProjection, self).__init__()
+        self.array_type = array_type
+        self.element_projection = element_projection
+        self.row_getter = None
+        layout = array_type.record_layout
+        if array_type.tuple_rows and layout is not None:
+            columns = layout.select_columns(layout.shape, tree)
+            if len(columns) == 1:
+                self.row_getter = lambda row, i=columns[0]: (row[i],)
+            else:
+                self.row_getter = operator.itemgetter(*columns)
+
+    def deserialize(self, byte_stream_reader):
+        read_length = self.array_type.length
+        if not self.array_type.fixed_length:
+            read_length = UINT_16.deserialize(byte_stream_reader)
+        if self.row_getter is not None:
+            rows = self.array_type.record_layout.unpack(byte_stream_reader, read_length, True)
+            return tuple(map(self.row_getter, rows))
+        return tuple([self.element_projection.deserialize(byte_stream_reader) for i in range(0, read_length)])
+
+
+# Stateless codec entry points. A frozen schema holds no per-call state, so they are safe to call
+# from any number of threads sharing the same schema.
+
+
+# cache is an optional FragmentCache.
+def encode(schema, runtime_value, cache=None):
+    return ToHexString(schema.serialize(runtime_value, cache))
+
+
+def decode(schema, hex_str):
+    return schema.deserialize(ByteArrayInputStream(ParseHexString(hex_str)))
+
+
+def encode_bytes(schema, runtime_value, cache=None):
+    return schema.serialize(runtime_value, cache)
+
+
+def decode_bytes(schema, data):
+    return schema.deserialize(ByteArrayInputStream(data))
+
+
+# Preset-dictionary compression for small messages.
+
+
+def train_zdict(schema, samples, size=ZDICT_MAX_SIZE, segment_size=8):
+    """Build a preset dictionary out of the byte segments shared by the encoded samples.
+
+    Segments found in the most samples are placed at the end of the dictionary, where deflate reaches them
+    with the shortest distances.
+    """
+    counts = {}
+    for sample in samples:
+        payload = encode_bytes(schema, sample)
+        seen = set([payload[i:i + segment_size] for i in range(0, len(payload) - segment_size + 1)])
+        for segment in seen:
+            counts[segment] = counts.get(segment, 0) + 1
+    # 只出现在一个样本里的片段没有共享价值
+    segments = sorted([x for x in counts if counts[x] > 1], key=lambda x: (counts[x], x), reverse=True)
+    zdict = b""
+    for segment in segments:
+        if segment in zdict:
+            continue
+        # 与字典开头重叠的部分只需要存一次
+        overlap = segment_size - 1
+        while overlap > 0 and not zdict.startswith(segment[-overlap:]):
+            overlap -= 1
+        if len(zdict) + segment_size - overlap > size:
+            break
+        zdict = segment[:segment_size - overlap] + zdict
+    return zdict
+
+
+class DictCompressor(object):
+    """Compresses single encoded messages into raw deflate streams against a preset dictionary.
+
+    The dictionary is pushed through a compressor once and every message starts from a copy of that primed state,
+    which is about twice as fast as handing zdict to a fresh compressor each time and yields the same stream.
+    Decompression just loads zdict into the window, which is cheaper than copying a primed decompressor.
+    """
+
+    def __init__(self, zdict, level=zlib.Z_BEST_COMPRESSION):
+        super(DictCompressor, self).__init__()
+        self.zdict = zdict
+        self.dict_id = zlib.adler32(zdict)
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.compressor.compress(zdict)
+        self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def compress(self, data):
+        compressor = self.compressor.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    # raw deflate has no checksum, the final block marker is the only sign that the whole message arrived.
+    def decompress(self, data):
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self.zdict)
+        res = decompressor.decompress(data) + decompressor.flush()
+        if not decompressor.eof:
+            raise zlib.error("incomplete or truncated stream")
+        if decompressor.unused_data:
+            raise zlib.error("%d bytes of trailing data after the stream" % len(decompressor.unused_data))
+        return res
+
+
 # Then we defile field
 
 
@@ -486,22 +1017,28 @@ class CompositeField(Field):
 
 class ByteArrayInputStream(object):
 
+    # arr is bytes, bytearray or memoryview, reads slice it without copying the rest.
     def __init__(self, arr):
         super(ByteArrayInputStream, self).__init__()
         self.arr = arr
         self.index = 0
 
     def advance(self, count=1):
-        self.arr = self.arr[self.index + count:]
+        self.index += count
 
     def read(self, count=1):
-        b = self.peek(count)
-        self.advance(count)
-        return b
+        index = self.index
+        self.index = index + count
+        return self.arr[index:index + count]
 
     def peek(self, count=1):
         return self.arr[self.index:self.index + count]
 
+    def unpack(self, st):
+        value = st.unpack_from(self.arr, self.index)[0]
+        self.index += st.size
+        return value
+
 
 class ProtoReader(object):
     def __init__(self, proto_str):
@@ -546,7 +1083,7 @@ class ProtoReader(object):
             elif is_valid_c_style_var_name(ch, first=False):
                 name += ch
             else:
-                print "ERROR  " + name
+                print("ERROR  " + name)
                 raise self.error(
                     "not a valid char for c-style variable name: %s." % ch)
 
@@ -583,11 +1120,56 @@ class ProtoReader(object):
         raise Exception("At {}, {}.".format(self.index, msg))
 
 
+class Message(object):
+    """A named top-level block of a schema file, compiled into a frozen CompositeType on first use."""
+
+    def __init__(self, parser, name, proto_text):
+        super(Message, self).__init__()
+        self.parser = parser
+        self.name = name
+        self.proto_text = proto_text
+        self.schema = None
+        self.lock = threading.Lock()
+        self.projections = {}
+        self.dict_compressor = None
+
+    def get_schema(self):
+        schema = self.schema
+        if schema is None:
+            with self.lock:
+                if self.schema is None:
+                    self.schema = self.parser.compile_message(self.proto_text)
+                schema = self.schema
+        return schema
+
+    def is_compiled(self):
+        return self.schema is not None
+
+    # Plans are cached per field list, a concurrent miss just compiles the same immutable plan twice.
+    def get_projection(self, fields):
+        key = tuple(fields)
+        projection = self.projections.get(key)
+        if projection is None:
+            projection = Projection(self.get_schema(), Projection.build_field_tree(key))
+            self.projections[key] = projection
+        return projection
+
+    # identifies the block text a dictionary file was trained for, unnamed messages are only named by position.
+    def get_schema_id(self):
+        return zlib.adler32(self.proto_text.encode("utf-8"))
+
+    def get_dict_compressor(self):
+        if self.dict_compressor is None:
+            self.parser.raise_error("no preset dictionary has been trained or loaded for message %s" % self.name)
+        return self.dict_compressor
+
+
 class ProtoParser(object):
-    def __init__(self):
+    # tuple_rows: decode arrays of fixed-size composites into flat tuples rather than dicts, see RecordLayout.
+    def __init__(self, tuple_rows=False):
         super(ProtoParser, self).__init__()
-        self.root_fields = CompositeField("root")
-        self.parsing_fields_pack = []
+        self.tuple_rows = tuple_rows
+        self.messages = OrderedDict()
         self.curr_filename = ""
         self.compress_map = {}
 
@@ -700,7 +1282,8 @@ class ProtoParser(object):
             return ArrayField(parsed_type, field_name, None)
         return Field(TypeNamingMap[type_name], field_name, None)
 
-    def parse_into(self, reader, pack):
+    # stack is local to a single parse() call, so concurrent parses never share it.
+    def parse_into(self, reader, pack, stack):
         while not reader.reach_end():
             ch = reader.read_skip_blank()
             if ch == 'i':
@@ -724,56 +1307,172 @@ class ProtoParser(object):
             elif ch == '{':
                 sub_field = CompositeField("stub-name")
                 # 入parsing stack
-                self.parsing_fields_pack.append(sub_field)
-                self.parse_into(reader, sub_field)
+                stack.append(sub_field)
+                self.parse_into(reader, sub_field, stack)
                 continue
             elif ch == '}':
                 # pack结束, 对于子CompositeField, 需要额外处理，加上名字。
-                if len(self.parsing_fields_pack) > 1:
+                if len(stack) > 1:
                     is_array, size = self.try_parse_array_definition(reader)
                     field_name = self.parse_field_name(reader)
                     # {时入, }时出
-                    self.parsing_fields_pack = self.parsing_fields_pack[:-1]
+                    stack.pop()
                     if is_array:
                         wrap_field = ArrayField(
-                            ArrayType(pack.typ, size), field_name, None)
+                            ArrayType(pack.typ, size, self.tuple_rows), field_name, None)
                         # 将栈顶替换为包装后的数组类型
-                        self.parsing_fields_pack[-1:][0].add_field(wrap_field)
+                        stack[-1].add_field(wrap_field)
                     else:
                         pack.name = field_name
-                        self.parsing_fields_pack[-1:][0].add_field(pack)
+                        stack[-1].add_field(pack)
                 return
             else:
                 self.raise_error("invalid ch %s at %s" % (ch, reader.index - 1))
 
-    def dumps(self, d):
-        self.root_fields.set_value(d)
-        return ToHexString(self.root_fields.serialize())
-
-    def loads(self, s):
-        data = ParseHexString(s)
-        return self.root_fields.deserialize(ByteArrayInputStream(data))
-
-    def dumpComp(self, d):
-        return zlib.compress(self.dumps(d))
-
-    def loadComp(self, s):
-        return self.loads(zlib.decompress(s))
+    # message is a message name, None selects the first message of the schema file.
+    def get_message(self, message=None):
+        messages = self.messages
+        if not messages:
+            self.raise_error("no schema has been built yet")
+        if message is None:
+            return next(iter(messages.values()))
+        if message not in messages:
+            self.raise_error("message %s is not defined" % message)
+        return messages[message]
+
+    def get_schema(self, message=None):
+        return self.get_message(message).get_schema()
+
+    def get_message_names(self):
+        return list(self.messages.keys())
+
+    # cache is an optional FragmentCache that repeated immutable sub-values are served from.
+    def dumps(self, d, message=None, cache=None):
+        return encode(self.get_schema(message), d, cache)
+
+    # fields selects the dot separated field paths to decode, the result then only holds those paths.
+    def loads(self, s, message=None, fields=None):
+        if fields is not None:
+            return decode(self.get_message(message).get_projection(fields), s)
+        return decode(self.get_schema(message), s)
+
+    def dumpComp(self, d, message=None, cache=None):
+        return zlib.compress(self.dumps(d, message, cache).encode("ascii"))
+
+    def loadComp(self, s, message=None):
+        return self.loads(zlib.decompress(s).decode("ascii"), message)
+
+    # Unlike dumpComp, the binary encoding rather than the hex string is compressed.
+    # Every message has a dictionary of its own, trained by trainDict with samples of that message.
+    def dumpDictComp(self, d, message=None, cache=None):
+        msg = self.get_message(message)
+        return msg.get_dict_compressor().compress(encode_bytes(msg.get_schema(), d, cache))
+
+    def loadDictComp(self, s, message=None):
+        msg = self.get_message(message)
+        return decode_bytes(msg.get_schema(), msg.get_dict_compressor().decompress(s))
+
+    def get_dict_compressor(self, message=None):
+        return self.get_message(message).get_dict_compressor()
+
+    def trainDict(self, samples, message=None, size=ZDICT_MAX_SIZE):
+        msg = self.get_message(message)
+        zdict = train_zdict(msg.get_schema(), samples, size)
+        msg.dict_compressor = DictCompressor(zdict)
+        return zdict
+
+    # default is <schema file>.<message name>.zdict
+    def get_zdict_filename(self, filename, message=None):
+        if filename is not None:
+            return filename
+        if not self.curr_filename:
+            self.raise_error("dictionary filename is required when the schema is not built from a file")
+        return "%s.%s%s" % (self.curr_filename, self.get_message(message).name, ZDICT_FILE_SUFFIX)
+
+    # The dictionary is saved alongside the schema file by default, buildDesc picks it up from there.
+    # Raw deflate carries no dictionary id, so the file records the message's schema id and loadDict refuses a
+    # dictionary trained for a different block.
+    def saveDict(self, filename=None, message=None):
+        msg = self.get_message(message)
+        dict_compressor = msg.get_dict_compressor()
+        with open(self.get_zdict_filename(filename, message), "wb") as f:
+            f.write(ZDICT_FILE_HEADER.pack(ZDICT_FILE_MAGIC, msg.get_schema_id(), dict_compressor.dict_id))
+            f.write(dict_compressor.zdict)
+
+    def loadDict(self, filename=None, message=None):
+        msg = self.get_message(message)
+        filename = self.get_zdict_filename(filename, message)
+        with open(filename, "rb") as f:
+            data = f.read()
+        if len(data) < ZDICT_FILE_HEADER.size:
+            self.raise_error("%s is not a dictionary file" % filename)
+        magic, schema_id, dict_id = ZDICT_FILE_HEADER.unpack_from(data)
+        zdict = data[ZDICT_FILE_HEADER.size:]
+        if magic != ZDICT_FILE_MAGIC:
+            self.raise_error("%s is not a dictionary file" % filename)
+        if schema_id != msg.get_schema_id():
+            self.raise_error("%s was trained for another schema than message %s, retrain or remove it"
+                             % (filename, msg.name))
+        if dict_id != zlib.adler32(zdict):
+            self.raise_error("%s is corrupted" % filename)
+        msg.dict_compressor = DictCompressor(zdict)
+
+    # return name or None, a top-level block may be named like a field: {...} name;
+    def try_parse_message_name(self, reader):
+        ch = reader.read_skip_blank()
+        if ch == "":
+            return None
+        reader.advance(-1)
+        if not is_valid_c_style_var_name(ch, first=True):
+            return None
+        return self.parse_field_name(reader)
 
+    def compile_message(self, proto_text):
+        reader = ProtoReader(proto_text)
+        root_fields = CompositeField("root")
+        if reader.read_skip_blank() != '{':
+            self.raise_error("message should be started with {")
+        self.parse_into(reader, root_fields, [root_fields])
+        return root_fields.typ.freeze()
+
+    # Only the boundaries of each top-level block are scanned here, the block itself is compiled lazily
+    # by Message.get_schema.
     def parse(self, proto_text):
         reader = ProtoReader(proto_text)
+        messages = OrderedDict()
         while not reader.reach_end():
             ch = reader.read_skip_blank()
-            if ch == '{':
-                self.parsing_fields_pack.append(self.root_fields)
-                self.parse_into(reader, self.root_fields)
-                self.parsing_fields_pack = self.parsing_fields_pack[:-1]
+            if ch != '{':
+                continue
+            start = reader.index - 1
+            depth = 1
+            while depth > 0:
+                if reader.reach_end():
+                    self.raise_error("message started at %s is not closed" % start)
+                ch = reader.read()
+                if ch == '{':
+                    depth += 1
+                elif ch == '}':
+                    depth -= 1
+            block = reader.proto_str[start:reader.index]
+            name = self.try_parse_message_name(reader)
+            if name is None:
+                # 匿名消息以其在文件中的序号命名
+                name = str(len(messages))
+            if name in messages:
+                self.raise_error("message %s is defined more than once" % name)
+            messages[name] = Message(self, name, block)
+        # Publish the messages only once the whole file has been scanned.
+        self.messages = messages
 
     def buildDesc(self, filename):
         self.curr_filename = filename
-        with open(filename, "r") as f:
+        with open(filename, "r", encoding="utf-8") as f:
             proto_text = "".join(f.readlines())
             self.parse(proto_text)
+        for name in self.messages:
+            if os.path.exists(self.get_zdict_filename(None, name)):
+                self.loadDict(message=name)
 
     def raise_error(self, msg):
         raise Exception("PARSER ERROR: " + msg)